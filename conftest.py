@@ -0,0 +1,60 @@
+# Shared fixtures: main.py opens DB_PATH and writes STATIC_DIR at import, so point both
+# at a throwaway directory and seed a minimal schema before it is imported.
+import os
+import sqlite3
+import tempfile
+
+import pytest
+
+_TMP = tempfile.mkdtemp(prefix="compliance_dashboard_test_")
+os.environ["DB_PATH"] = os.path.join(_TMP, "ppm_test.db")
+os.environ["STATIC_DIR"] = os.path.join(_TMP, "static")
+
+SCHEMA = """
+CREATE TABLE site_type (site_type_code TEXT PRIMARY KEY, site_type_name TEXT);
+CREATE TABLE category (category_id INTEGER PRIMARY KEY, name TEXT);
+CREATE TABLE site (
+  site_id TEXT PRIMARY KEY, name TEXT, uprn TEXT, site_code TEXT,
+  status TEXT, site_type_code TEXT, updated_at TEXT
+);
+CREATE TABLE ppm_plan (
+  ppm_plan_id INTEGER PRIMARY KEY, site_id TEXT, category_id INTEGER, instruction TEXT,
+  priority TEXT, next_due_date TEXT, finished_date TEXT, frequency_months INTEGER
+);
+INSERT INTO site_type VALUES ('PUB', 'Pub'), ('RES', 'Restaurant');
+INSERT INTO category VALUES (1, 'Fire'), (2, 'Gas');
+INSERT INTO site VALUES
+  ('S1', 'Red Lion', 'UP0001', 'RL1', 'Active', 'PUB', NULL),
+  ('S2', 'Blue Anchor', 'UP0002', 'BA2', 'Active', 'RES', NULL),
+  ('S3', 'Green Man', 'UP0003', 'GM3', 'Closed', 'PUB', NULL);
+INSERT INTO ppm_plan (ppm_plan_id, site_id, category_id, instruction, priority, next_due_date, frequency_months) VALUES
+  (1, 'S1', 1, 'Fire alarm test', 'High', '2000-01-01', 12),
+  (2, 'S1', 2, 'Gas safety', 'Low', '2999-01-01', 12),
+  (3, 'S2', 1, 'Fire alarm test', 'High', '2999-01-01', 12),
+  (4, 'S2', 2, 'Gas safety', 'Low', '2999-01-01', 12),
+  (5, 'S3', 1, 'Fire alarm test', 'High', '2999-01-01', 12);
+"""
+
+with sqlite3.connect(os.environ["DB_PATH"]) as _conn:
+    _conn.executescript(SCHEMA)
+
+
+@pytest.fixture(scope="session")
+def app_module():
+    import main
+    return main
+
+
+@pytest.fixture(scope="session")
+def client(app_module):
+    from fastapi.testclient import TestClient
+    with TestClient(app_module.app) as c:
+        yield c
+
+
+@pytest.fixture
+def db():
+    conn = sqlite3.connect(os.environ["DB_PATH"])
+    conn.row_factory = sqlite3.Row
+    yield conn
+    conn.close()
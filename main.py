@@ -1,25 +1,127 @@
 # main.py — FastAPI dashboard + admin using your UI sheet design
+import asyncio
+import csv
+import gzip
+import hashlib
+import logging
 import os
+import re
 import sqlite3
+import time
+from contextlib import asynccontextmanager
 from datetime import date, timedelta
+from pathlib import Path
 from typing import Optional, Literal, Any
 
-from fastapi import FastAPI, Query, HTTPException, Response
-from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse
+import aiosqlite
+import orjson
+from fastapi import FastAPI, Query, HTTPException, Request, Response, BackgroundTasks
+from fastapi.responses import StreamingResponse
+from fastapi.staticfiles import StaticFiles
 
-from pydantic import BaseModel, field_validator
+from pydantic import BaseModel, model_validator
 
 DB_PATH = os.environ.get("DB_PATH", "ppm_local.db")
+log = logging.getLogger(__name__)
+
+STATIC_DIR = os.environ.get("STATIC_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "static"))
+
+READ_POOL_SIZE = 4
+EXPORT_CONCURRENCY = 2
+SUMMARY_TTL_SECONDS = 15
+AGG_REFRESH_SECONDS = 60
+CSV_CHUNK_ROWS = 500
 
 # --------------------- DB helpers ---------------------
-def db():
-    conn = sqlite3.connect(DB_PATH)
+_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-64000",      # ~64 MB
+    "PRAGMA mmap_size=268435456",    # 256 MB
+)
+
+# One autocommit writer (SQLite serializes writes anyway) guarded by a lock, plus a
+# small pool of read-only connections for SELECTs. WAL lets readers run alongside the writer.
+# Opened on startup; read_conn() waits when all readers are checked out.
+_writer: Optional[aiosqlite.Connection] = None
+_write_lock = asyncio.Lock()
+_readers: "asyncio.Queue[aiosqlite.Connection]" = asyncio.Queue(maxsize=READ_POOL_SIZE)
+# CSV exports open their own connection (see export_conn); cap how many exist at once.
+_export_slots = asyncio.Semaphore(EXPORT_CONCURRENCY)
+
+async def _make_conn(readonly: bool = False) -> aiosqlite.Connection:
+    if readonly:
+        # as_uri() percent-encodes '#', '?' and '%' that would otherwise break URI parsing
+        conn = await aiosqlite.connect(Path(DB_PATH).resolve().as_uri() + "?mode=ro", uri=True)
+    else:
+        conn = await aiosqlite.connect(DB_PATH, isolation_level=None)
     conn.row_factory = sqlite3.Row
+    for pragma in _PRAGMAS:
+        await conn.execute(pragma)
     return conn
 
+async def init_pool():
+    global _writer
+    _writer = await _make_conn()  # first, so WAL is on before readers attach
+    while not _readers.full():
+        _readers.put_nowait(await _make_conn(readonly=True))
+
+async def close_pool():
+    global _writer
+    while not _readers.empty():
+        await _readers.get_nowait().close()
+    if _writer is not None:
+        await _writer.close()
+        _writer = None
+
+@asynccontextmanager
+async def read_conn():
+    """Borrow a read-only connection for the duration of the block."""
+    conn = await _readers.get()
+    try:
+        yield conn
+    finally:
+        _readers.put_nowait(conn)
+
+@asynccontextmanager
+async def export_conn():
+    """
+    A private read-only connection for a streaming export. Exports hold their
+    connection until the client has read the last chunk, so they must not
+    tie up the shared readers that the JSON routes depend on. At most
+    EXPORT_CONCURRENCY are open at once; further exports wait for a slot.
+    """
+    async with _export_slots:
+        conn = await _make_conn(readonly=True)
+        try:
+            yield conn
+        finally:
+            await conn.close()
+
+@asynccontextmanager
+async def write_conn():
+    """
+    Exclusive use of the shared writer. It runs in autocommit mode, so
+    multi-statement changes must wrap themselves in BEGIN ... COMMIT.
+    """
+    async with _write_lock:
+        try:
+            yield _writer
+        except BaseException:
+            if _writer.in_transaction:
+                await _writer.rollback()
+            raise
+
+async def fetch_dicts(conn: aiosqlite.Connection, sql: str, params: Any = ()) -> list[dict[str, Any]]:
+    """Rows as plain dicts: tuples zipped with the column names read once from cursor.description."""
+    async with conn.execute(sql, params) as cur:
+        cur.row_factory = None
+        cols = [d[0] for d in cur.description]
+        return [dict(zip(cols, r)) for r in await cur.fetchall()]
+
 def ensure_views_and_columns():
-    conn = db()
+    conn = sqlite3.connect(DB_PATH)
     cur = conn.cursor()
     # lifecycle columns (safe if already exist)
     for col, ddl in [
@@ -49,24 +151,158 @@ def ensure_views_and_columns():
     cur.execute("CREATE INDEX IF NOT EXISTS idx_site_type ON site(site_type_code)")
     cur.execute("CREATE INDEX IF NOT EXISTS idx_ppm_cat ON ppm_plan(category_id)")
     cur.execute("CREATE INDEX IF NOT EXISTS idx_ppm_pri ON ppm_plan(priority)")
+    # superseded by idx_ppm_site_cat_pri, which also covers the per-site aggregate
+    cur.execute("DROP INDEX IF EXISTS idx_ppm_site_due")
+    # covering indexes: carry the lifecycle columns so view_active_ppm filters never touch the table
+    # (not named idx_ppm_active_due: the lifecycle notes suggest creating an index by that name by hand)
+    new_indexes = not cur.execute("SELECT 1 FROM sqlite_master WHERE type='index' AND name='idx_ppm_due_cover'").fetchone()
+    cur.execute("""
+    CREATE INDEX IF NOT EXISTS idx_ppm_due_cover
+    ON ppm_plan(next_due_date, is_active, suspended_until, site_id)
+    """)
+    cur.execute("""
+    CREATE INDEX IF NOT EXISTS idx_ppm_site_cat_pri
+    ON ppm_plan(site_id, category_id, priority, is_active, suspended_until, next_due_date)
+    """)
+    if new_indexes:
+        cur.execute("ANALYZE")  # planner stats for the new indexes
+
+    # full-text index over site search fields (external content: rows live in site)
+    has_fts = cur.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='site_fts'").fetchone()
+    cur.execute("""
+    CREATE VIRTUAL TABLE IF NOT EXISTS site_fts USING fts5(
+      name, site_code, uprn, content='site', content_rowid='rowid', tokenize='unicode61'
+    )
+    """)
+    if not has_fts:
+        cur.execute("INSERT INTO site_fts(site_fts) VALUES('rebuild')")
+    cur.executescript("""
+    CREATE TRIGGER IF NOT EXISTS site_fts_ai AFTER INSERT ON site BEGIN
+      INSERT INTO site_fts(rowid, name, site_code, uprn) VALUES (new.rowid, new.name, new.site_code, new.uprn);
+    END;
+    CREATE TRIGGER IF NOT EXISTS site_fts_ad AFTER DELETE ON site BEGIN
+      INSERT INTO site_fts(site_fts, rowid, name, site_code, uprn) VALUES ('delete', old.rowid, old.name, old.site_code, old.uprn);
+    END;
+    CREATE TRIGGER IF NOT EXISTS site_fts_au AFTER UPDATE OF name, site_code, uprn ON site BEGIN
+      INSERT INTO site_fts(site_fts, rowid, name, site_code, uprn) VALUES ('delete', old.rowid, old.name, old.site_code, old.uprn);
+      INSERT INTO site_fts(rowid, name, site_code, uprn) VALUES (new.rowid, new.name, new.site_code, new.uprn);
+    END;
+    """)
+
+    # materialized per-site aggregates (see refresh_ppm_site_agg)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS ppm_site_agg (
+      site_id TEXT PRIMARY KEY,
+      min_next_due TEXT,
+      overdue_count INTEGER NOT NULL DEFAULT 0,
+      active_ppm INTEGER NOT NULL DEFAULT 0,
+      refreshed_at TEXT
+    )
+    """)
     conn.commit()
     conn.close()
 
+async def refresh_ppm_site_agg(conn: aiosqlite.Connection):
+    """Rebuild ppm_site_agg from view_active_ppm in a single transaction."""
+    await conn.execute("BEGIN")
+    await conn.execute("DELETE FROM ppm_site_agg")
+    await conn.execute("""
+    INSERT INTO ppm_site_agg (site_id, min_next_due, overdue_count, active_ppm, refreshed_at)
+    SELECT site_id,
+           MIN(next_due_date),
+           SUM(CASE WHEN next_due_date IS NOT NULL AND next_due_date < ? THEN 1 ELSE 0 END),
+           COUNT(*),
+           CURRENT_TIMESTAMP
+    FROM view_active_ppm
+    GROUP BY site_id
+    """, (date.today().isoformat(),))
+    await conn.execute("COMMIT")
+
+async def _refresh_agg():
+    async with write_conn() as conn:
+        await refresh_ppm_site_agg(conn)
+
 ensure_views_and_columns()
 
 # --------------------- FastAPI app ---------------------
-app = FastAPI(title="Compliance Dashboard API")
-
-# CORS (so you can call from other tools/ports if needed)
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],  # tighten later if needed
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+class ORJSONResponse(Response):
+    """JSON via orjson (Rust): serializes straight to bytes, several times faster than json.dumps."""
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content)
+
+_agg_task: Optional[asyncio.Task] = None
+
+async def _agg_refresh_loop():
+    # keeps overdue counts correct across date rollover and external DB edits
+    while True:
+        await asyncio.sleep(AGG_REFRESH_SECONDS)
+        try:
+            await _refresh_agg()
+        except Exception:
+            # e.g. "database is locked" while an import script holds the write lock; try next pass
+            log.exception("ppm_site_agg refresh failed; retrying in %ss", AGG_REFRESH_SECONDS)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global _agg_task
+    await init_pool()
+    await _refresh_agg()
+    _agg_task = asyncio.create_task(_agg_refresh_loop())
+    try:
+        yield
+    finally:
+        _agg_task.cancel()
+        try:
+            await _agg_task
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            log.exception("ppm_site_agg refresh task died")
+        await close_pool()
+
+app = FastAPI(title="Compliance Dashboard API", default_response_class=ORJSONResponse, lifespan=lifespan)
+
+# CORS (so you can call from other tools/ports if needed). No credentials are used, so a
+# static wildcard header is enough; skips CORSMiddleware's per-request origin matching.
+_CORS_ORIGIN = (b"access-control-allow-origin", b"*")
+_PREFLIGHT_HEADERS = [
+    _CORS_ORIGIN,
+    (b"access-control-allow-methods", b"GET, POST, PATCH, PUT, DELETE, OPTIONS"),
+    (b"access-control-max-age", b"600"),
+]
+
+class StaticCORSMiddleware:
+    """Adds Access-Control-Allow-Origin: * to every response and answers OPTIONS with 204."""
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        if scope["method"] == "OPTIONS":
+            headers = list(_PREFLIGHT_HEADERS)
+            for k, v in scope["headers"]:
+                if k == b"access-control-request-headers":
+                    headers.append((b"access-control-allow-headers", v))
+            await send({"type": "http.response.start", "status": 204, "headers": headers})
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        async def send_with_cors(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", []), _CORS_ORIGIN]
+            await send(message)
+
+        await self.app(scope, receive, send_with_cors)
+
+app.add_middleware(StaticCORSMiddleware)
 
 # --------------------- Models ---------------------
+_DATE_RE = re.compile(r"[0-9]{4}-[0-9]{2}-[0-9]{2}")
+_DATE_FIELDS = ("finished_date", "next_due_date", "retired_at", "suspended_until")
+
 class PpmUpdate(BaseModel):
     finished_date: Optional[str] = None       # 'YYYY-MM-DD' or None
     next_due_date: Optional[str] = None
@@ -75,15 +311,19 @@ class PpmUpdate(BaseModel):
     retired_at: Optional[str] = None
     suspended_until: Optional[str] = None
 
-    # pydantic v2: use field_validator
-    @field_validator("finished_date", "next_due_date", "retired_at", "suspended_until", mode="before")
+    # pydantic v2: one before-validator for all date fields (single compiled-regex check each)
+    @model_validator(mode="before")
     @classmethod
-    def date_like(cls, v):
-        if v in (None, ""):
-            return None
-        if isinstance(v, str) and len(v) == 10 and v[4] == "-" and v[7] == "-":
-            return v
-        raise ValueError("Dates must be YYYY-MM-DD")
+    def date_like(cls, data):
+        if not isinstance(data, dict):
+            return data
+        for k in _DATE_FIELDS:
+            v = data.get(k)
+            if v == "":
+                data = {**data, k: None}
+            elif v is not None and not (isinstance(v, str) and _DATE_RE.fullmatch(v)):
+                raise ValueError("Dates must be YYYY-MM-DD")
+        return data
 
 class SiteUpdate(BaseModel):
     status: Literal["Active", "Closed", "Suspended", "Under-Construction", "Unknown"]
@@ -95,6 +335,7 @@ def classify_site_status(min_next_due: Optional[str], has_overdue: bool) -> str:
     - DUE (red): any overdue
     - DUE_SOON (amber): next due within 30 days
     - OK (green): else
+    /api/sites evaluates the same rules in SQL (SITES_CARD_SELECT); keep both in step.
     """
     if has_overdue:
         return "DUE"
@@ -108,68 +349,181 @@ def classify_site_status(min_next_due: Optional[str], has_overdue: bool) -> str:
         return "DUE_SOON"
     return "OK"
 
-def build_where(filters: dict[str, Any], params: list[Any]) -> str:
+_WORD_RE = re.compile(r"\w+")
+
+def ppm_update_fields(body: PpmUpdate) -> tuple[list[str], list[Any]]:
+    """SET clauses and their bound values for a PPM edit (without the trailing id)."""
+    fields = []
+    vals: list[Any] = []
+
+    for k in ("finished_date", "next_due_date", "retired_reason", "suspended_until"):
+        v = getattr(body, k)
+        if v is not None:
+            fields.append(f"{k} = ?")
+            vals.append(v or None)
+
+    if body.is_active is not None:
+        fields.append("is_active = ?")
+        vals.append(1 if body.is_active else 0)
+        if not body.is_active:
+            if body.retired_at is not None:
+                fields.append("retired_at = ?"); vals.append(body.retired_at)
+            else:
+                fields.append("retired_at = ?"); vals.append(date.today().isoformat())
+        else:
+            fields.append("retired_at = NULL")
+            fields.append("retired_reason = NULL")
+    return fields, vals
+
+def make_etag(data: bytes) -> str:
+    return '"' + hashlib.sha1(data).hexdigest() + '"'
+
+def not_modified(request: Request, etag: str) -> bool:
+    return request.headers.get("if-none-match") == etag
+
+class _Echo:
+    """Write-through sink so csv.writer.writerow() returns the formatted line."""
+    def write(self, line: str) -> str:
+        return line
+
+def fts_query(text: str) -> str:
+    """
+    Turn free text into an FTS5 MATCH expression over site_fts:
+    every word must prefix-match a token in name, site_code or uprn.
+    """
+    return " ".join(f'"{w}"*' for w in _WORD_RE.findall(text))
+
+def _today_bounds() -> tuple[str, str, str]:
+    """Today, today + 30 days and today + 90 days as ISO dates (computed once per request)."""
+    today = date.today()
+    return (today.isoformat(),
+            (today + timedelta(days=30)).isoformat(),
+            (today + timedelta(days=90)).isoformat())
+
+# Fixed WHERE texts for /api/sites and the CSV export. Filters are "(? IS NULL OR ...)"
+# slots, so each text is one prepared statement for every filter combination. There are
+# two texts so that a search lets FTS drive the query (rowid lookups into site); without a
+# search SQLite scans site, which is small, and the status/type slots can't use an index.
+_SITE_FILTERS = """
+            (? IS NULL OR s.status = ?)
+        AND (? IS NULL OR s.site_type_code = ?)
+        AND EXISTS (
+          SELECT 1 FROM view_active_ppm ap
+          WHERE ap.site_id = s.site_id
+            AND (? IS NULL OR ap.category_id = ?)
+            AND (? IS NULL OR ap.priority = ?)
+            AND (? IS NULL OR ap.next_due_date >= ?)
+            AND (? IS NULL OR ap.next_due_date < ?)
+            AND (? IS NULL OR ap.next_due_date <= ?)
+        )"""
+
+SITES_WHERE = """
+      WHERE (? IS NULL OR LOWER(s.name) LIKE ? OR LOWER(s.site_code) LIKE ? OR LOWER(s.uprn) LIKE ?)
+        AND""" + _SITE_FILTERS
+
+SITES_WHERE_FTS = """
+      WHERE s.rowid IN (SELECT rowid FROM site_fts WHERE site_fts MATCH ?)
+        AND""" + _SITE_FILTERS
+
+def build_where(filters: dict[str, Any], params: list[Any],
+                today: str, today_30: str, today_90: str) -> str:
     """
     Compose WHERE additions for /api/sites with filter toolbar options.
     Filters supported: q, status, site_type, category_id, priority, due_window
     due_window: 'overdue' | 'soon' | 'quarter' | 'all' (default 'all')
+    today / today_30 / today_90: ISO dates for now, +30 and +90 days.
+
+    Returns SITES_WHERE_FTS when q has searchable words, else SITES_WHERE;
+    unused filters bind NULL. Sites need at least one active PPM line to
+    match (the EXISTS is unconditional).
     """
-    where = " WHERE 1=1 "
-    if filters.get("status"):
-        where += " AND s.status = ?"
-        params.append(filters["status"])
-    if filters.get("site_type"):
-        where += " AND s.site_type_code = ?"
-        params.append(filters["site_type"])
-    if filters.get("q"):
-        like = f"%{filters['q'].lower()}%"
-        where += " AND (LOWER(s.name) LIKE ? OR LOWER(s.site_code) LIKE ? OR LOWER(s.uprn) LIKE ?)"
-        params += [like, like, like]
-    # join-level filters need EXISTS against active ppm
-    if filters.get("category_id") or filters.get("priority") or filters.get("due_window"):
-        # base exists on view_active_ppm (already lifecycle aware)
-        exists = " EXISTS (SELECT 1 FROM view_active_ppm ap WHERE ap.site_id=s.site_id "
-        if filters.get("category_id"):
-            exists += " AND ap.category_id = ?"
-            params.append(filters["category_id"])
-        if filters.get("priority"):
-            exists += " AND ap.priority = ?"
-            params.append(filters["priority"])
-        dw = filters.get("due_window", "all")
-        if dw == "overdue":
-            exists += " AND ap.next_due_date IS NOT NULL AND ap.next_due_date < date('now')"
-        elif dw == "soon":
-            exists += " AND ap.next_due_date BETWEEN date('now') AND date('now','+30 days')"
-        elif dw == "quarter":
-            exists += " AND ap.next_due_date BETWEEN date('now') AND date('now','+90 days')"
-        exists += " ) "
-        where += " AND " + exists
+    def slot(v):
+        params.extend((v, v))
+
+    q = filters.get("q") or ""
+    match = fts_query(q) if q else ""
+    if match:
+        where = SITES_WHERE_FTS
+        params.append(match)
+    else:
+        where = SITES_WHERE
+        # nothing the FTS tokenizer would index (e.g. punctuation only): plain substring scan
+        like = f"%{q.lower()}%" if q else None
+        params += [like, like, like, like]
+
+    slot(filters.get("status") or None)
+    slot(filters.get("site_type") or None)
+
+    # join-level filters: EXISTS against active ppm (view_active_ppm is lifecycle aware)
+    slot(filters.get("category_id") or None)
+    slot(filters.get("priority") or None)
+    dw = filters.get("due_window", "all")
+    due_from = today if dw in ("soon", "quarter") else None
+    due_before = today if dw == "overdue" else None
+    due_until = {"soon": today_30, "quarter": today_90}.get(dw)
+    slot(due_from)
+    slot(due_before)
+    slot(due_until)
     return where
 
+# --------------------- Summary cache ---------------------
+# Short-lived cache for /api/summary; keyed by today's date so counts roll over at midnight.
+# "generation" is bumped on every write so a query that started before the write can't
+# store its (stale) counts afterwards.
+_summary_cache: dict[str, Any] = {"key": None, "value": None, "expires": 0.0, "generation": 0}
+
+def _invalidate_summary():
+    _summary_cache["expires"] = 0.0
+    _summary_cache["generation"] += 1
+
+# Per-site card columns shared by /api/sites and the CSV export.
+# Aggregates come from ppm_site_agg; refreshed_at tells the caller how fresh they are.
+SITES_SELECT = """
+      SELECT s.site_id, s.name, s.uprn, s.site_code, s.status, s.site_type_code,
+             a.min_next_due, a.overdue_count, a.active_ppm, a.refreshed_at
+      FROM site s
+      LEFT JOIN ppm_site_agg a ON a.site_id = s.site_id"""
+
+# Dashboard card variant: normalized counts plus the RAG status (same rules as
+# classify_site_status), computed by SQLite. Binds (today, today + 30 days).
+SITES_CARD_SELECT = """
+      SELECT s.site_id, s.name, s.uprn, s.site_code, s.status, s.site_type_code,
+             NULLIF(a.min_next_due, '') AS min_next_due,
+             COALESCE(a.overdue_count, 0) AS overdue_count,
+             COALESCE(a.active_ppm, 0) AS active_ppm,
+             a.refreshed_at,
+             CASE WHEN a.overdue_count > 0 OR NULLIF(a.min_next_due, '') < ? THEN 'DUE'
+                  WHEN NULLIF(a.min_next_due, '') <= ? THEN 'DUE_SOON'
+                  ELSE 'OK' END AS ui_status
+      FROM site s
+      LEFT JOIN ppm_site_agg a ON a.site_id = s.site_id"""
+
 # --------------------- Routes ---------------------
 @app.get("/api/summary")
-def api_summary():
-    conn = db(); cur = conn.cursor()
-    total_sites = cur.execute("SELECT COUNT(*) FROM site").fetchone()[0]
-    active_sites = cur.execute("SELECT COUNT(*) FROM site WHERE status='Active'").fetchone()[0]
-    total_ppm_active = cur.execute("SELECT COUNT(*) FROM view_active_ppm").fetchone()[0]
-    overdue = cur.execute("""
-        SELECT COUNT(*) FROM view_active_ppm
-        WHERE next_due_date IS NOT NULL AND next_due_date < date('now')
-    """).fetchone()[0]
-    due_30 = cur.execute("""
-        SELECT COUNT(*) FROM view_active_ppm
-        WHERE next_due_date BETWEEN date('now') AND date('now','+30 days')
-    """).fetchone()[0]
-    non_compliant_sites = cur.execute("""
-        SELECT COUNT(DISTINCT s.site_id)
-        FROM site s
-        JOIN view_active_ppm p ON p.site_id = s.site_id
-        WHERE p.next_due_date IS NOT NULL AND p.next_due_date < date('now')
-    """).fetchone()[0]
+async def api_summary():
+    today, today_30, _ = _today_bounds()
+    key = today
+    if _summary_cache["key"] == key and time.monotonic() < _summary_cache["expires"]:
+        return _summary_cache["value"]
+
+    generation = _summary_cache["generation"]
+    async with read_conn() as conn:
+        async with conn.execute("""
+            SELECT
+              (SELECT COUNT(*) FROM site) AS total_sites,
+              (SELECT COUNT(*) FROM site WHERE status='Active') AS active_sites,
+              COUNT(*) AS total_ppm_active,
+              COALESCE(SUM(CASE WHEN p.next_due_date < ? THEN 1 ELSE 0 END), 0) AS overdue,
+              COALESCE(SUM(CASE WHEN p.next_due_date BETWEEN ? AND ? THEN 1 ELSE 0 END), 0) AS due_30,
+              COUNT(DISTINCT CASE WHEN p.next_due_date < ?
+                                   AND EXISTS (SELECT 1 FROM site s WHERE s.site_id = p.site_id)
+                                  THEN p.site_id END) AS non_compliant_sites
+            FROM view_active_ppm p
+        """, (today, today, today_30, today)) as cur:
+            (total_sites, active_sites, total_ppm_active,
+             overdue, due_30, non_compliant_sites) = await cur.fetchone()
     compliant_sites = active_sites - non_compliant_sites
-    conn.close()
-    return {
+    result = {
         "total_sites": total_sites,
         "active_sites": active_sites,
         "total_ppm_active": total_ppm_active,
@@ -177,21 +531,30 @@ def api_summary():
         "due_next_30": due_30,
         "compliant_sites": compliant_sites,
         "non_compliant_sites": non_compliant_sites,
-        "today": date.today().isoformat(),
+        "today": key,
     }
+    if _summary_cache["generation"] == generation:
+        _summary_cache.update(key=key, value=result, expires=time.monotonic() + SUMMARY_TTL_SECONDS)
+    return result
 
 @app.get("/api/filters")
-def api_filters():
+async def api_filters(request: Request, response: Response):
     """Options for filter toolbar: site types, categories, priorities seen in DB."""
-    conn = db(); cur = conn.cursor()
-    site_types = [dict(r) for r in cur.execute("SELECT site_type_code AS code, site_type_name AS name FROM site_type ORDER BY name NULLS LAST, code")]
-    categories = [dict(r) for r in cur.execute("SELECT category_id, name FROM category ORDER BY name")]
-    priorities = sorted({(r[0] or "").strip() for r in cur.execute("SELECT DISTINCT priority FROM ppm_plan") if (r[0] or "").strip()})
-    conn.close()
-    return {"site_types": site_types, "categories": categories, "priorities": priorities}
+    async with read_conn() as conn:
+        site_types = await fetch_dicts(conn, "SELECT site_type_code AS code, site_type_name AS name FROM site_type ORDER BY name NULLS LAST, code")
+        categories = await fetch_dicts(conn, "SELECT category_id, name FROM category ORDER BY name")
+        priorities = sorted({(r[0] or "").strip() for r in await conn.execute_fetchall("SELECT DISTINCT priority FROM ppm_plan") if (r[0] or "").strip()})
+    result = {"site_types": site_types, "categories": categories, "priorities": priorities}
+    # lookup data rarely changes: let the browser revalidate with If-None-Match
+    etag = make_etag(orjson.dumps(result, option=orjson.OPT_SORT_KEYS))
+    headers = {"ETag": etag, "Cache-Control": "max-age=60"}
+    if not_modified(request, etag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return result
 
 @app.get("/api/sites")
-def api_sites(q: Optional[str] = None,
+async def api_sites(q: Optional[str] = None,
               status: Optional[str] = None,
               site_type: Optional[str] = None,
               category_id: Optional[int] = None,
@@ -207,37 +570,26 @@ def api_sites(q: Optional[str] = None,
         "due_window": due_window,
     }
 
-    conn = db(); cur = conn.cursor()
-
-    params: list[Any] = []
-    where = build_where(filters, params)
+    today, today_30, today_90 = _today_bounds()
+    params: list[Any] = [today, today_30]
+    where = build_where(filters, params, today, today_30, today_90)
 
     sql = f"""
-      SELECT s.site_id, s.name, s.uprn, s.site_code, s.status, s.site_type_code,
-             (SELECT MIN(p2.next_due_date) FROM view_active_ppm p2 WHERE p2.site_id=s.site_id) AS min_next_due,
-             (SELECT SUM(CASE WHEN p3.next_due_date IS NOT NULL AND p3.next_due_date < date('now') THEN 1 ELSE 0 END)
-              FROM view_active_ppm p3 WHERE p3.site_id=s.site_id) AS overdue_count,
-             (SELECT COUNT(*) FROM view_active_ppm p4 WHERE p4.site_id=s.site_id) AS active_ppm
-      FROM site s
+      {SITES_CARD_SELECT}
       {where}
       ORDER BY s.name
       LIMIT ?
     """
     params.append(limit)
 
-    rows = [dict(r) for r in cur.execute(sql, params).fetchall()]
-    for r in rows:
-        r["min_next_due"] = r["min_next_due"] or None
-        r["overdue_count"] = int(r["overdue_count"] or 0)
-        r["active_ppm"] = int(r["active_ppm"] or 0)
-        r["ui_status"] = classify_site_status(r["min_next_due"], r["overdue_count"] > 0)
-    conn.close()
-    return rows
+    async with read_conn() as conn:
+        rows = await fetch_dicts(conn, sql, params)
+    # rows are plain str/int/None: hand them straight to orjson, skipping jsonable_encoder
+    return ORJSONResponse(rows)
 
 @app.get("/api/ppm")
-def api_ppm_by_site(site_id: str = Query(..., description="site.site_id"),
+async def api_ppm_by_site(site_id: str = Query(..., description="site.site_id"),
                     include_inactive: int = 0):
-    conn = db(); cur = conn.cursor()
     if include_inactive:
         q = """
         SELECT p.*, c.name AS category_name
@@ -246,7 +598,6 @@ def api_ppm_by_site(site_id: str = Query(..., description="site.site_id"),
         WHERE p.site_id = ?
         ORDER BY COALESCE(p.next_due_date, '9999-12-31') ASC
         """
-        rows = [dict(r) for r in cur.execute(q, (site_id,)).fetchall()]
     else:
         q = """
         SELECT p.*, c.name AS category_name
@@ -255,56 +606,63 @@ def api_ppm_by_site(site_id: str = Query(..., description="site.site_id"),
         WHERE p.site_id = ?
         ORDER BY COALESCE(p.next_due_date, '9999-12-31') ASC
         """
-        rows = [dict(r) for r in cur.execute(q, (site_id,)).fetchall()]
-    conn.close()
-    return rows
+    async with read_conn() as conn:
+        rows = await fetch_dicts(conn, q, (site_id,))
+    return ORJSONResponse(rows)
 
-@app.patch("/api/ppm/{ppm_plan_id}")
-def api_update_ppm(ppm_plan_id: int, body: PpmUpdate):
-    fields = []
-    vals: list[Any] = []
-
-    for k in ("finished_date", "next_due_date", "retired_reason", "suspended_until"):
-        v = getattr(body, k)
-        if v is not None:
-            fields.append(f"{k} = ?")
-            vals.append(v or None)
-
-    if body.is_active is not None:
-        fields.append("is_active = ?")
-        vals.append(1 if body.is_active else 0)
-        if not body.is_active:
-            if body.retired_at is not None:
-                fields.append("retired_at = ?"); vals.append(body.retired_at)
-            else:
-                fields.append("retired_at = date('now')")
+@app.patch("/api/ppm/bulk")
+async def api_update_ppm_bulk(items: list[tuple[int, PpmUpdate]], background_tasks: BackgroundTasks):
+    """
+    Apply many PPM edits in one transaction. Body: [[ppm_plan_id, {...PpmUpdate}], ...]
+    Consecutive rows touching the same set of columns share one executemany()
+    call; edits are applied in request order, so a later edit to an id wins.
+    "updated" is the number of rows actually changed (unknown ids don't count).
+    """
+    batches: list[tuple[list[str], list[list[Any]]]] = []
+    for ppm_plan_id, body in items:
+        fields, vals = ppm_update_fields(body)
+        if not fields:
+            raise HTTPException(status_code=400, detail=f"No updatable fields provided for ppm {ppm_plan_id}")
+        if batches and batches[-1][0] == fields:
+            batches[-1][1].append(vals + [ppm_plan_id])
         else:
-            fields.append("retired_at = NULL")
-            fields.append("retired_reason = NULL")
+            batches.append((fields, [vals + [ppm_plan_id]]))
+
+    updated = 0
+    async with write_conn() as conn:
+        await conn.execute("BEGIN")
+        for fields, rows in batches:
+            cur = await conn.executemany(f"UPDATE ppm_plan SET {', '.join(fields)} WHERE ppm_plan_id = ?", rows)
+            updated += cur.rowcount
+        await conn.execute("COMMIT")
+    _invalidate_summary()
+    background_tasks.add_task(_refresh_agg)
+    return {"ok": True, "updated": updated}
 
+@app.patch("/api/ppm/{ppm_plan_id}")
+async def api_update_ppm(ppm_plan_id: int, body: PpmUpdate, background_tasks: BackgroundTasks):
+    fields, vals = ppm_update_fields(body)
     if not fields:
         raise HTTPException(status_code=400, detail="No updatable fields provided")
 
     vals.append(ppm_plan_id)
-    conn = db(); cur = conn.cursor()
-    cur.execute(f"UPDATE ppm_plan SET {', '.join(fields)} WHERE ppm_plan_id = ?", vals)
-    conn.commit()
-    conn.close()
+    async with write_conn() as conn:
+        await conn.execute(f"UPDATE ppm_plan SET {', '.join(fields)} WHERE ppm_plan_id = ?", vals)
+    _invalidate_summary()
+    background_tasks.add_task(_refresh_agg)
     return {"ok": True}
 
 @app.patch("/api/site/{site_id}")
-def api_update_site(site_id: str, body: SiteUpdate):
-    conn = db(); cur = conn.cursor()
-    cur.execute("UPDATE site SET status=?, updated_at=CURRENT_TIMESTAMP WHERE site_id=?", (body.status, site_id))
+async def api_update_site(site_id: str, body: SiteUpdate):
+    async with write_conn() as conn:
+        cur = await conn.execute("UPDATE site SET status=?, updated_at=CURRENT_TIMESTAMP WHERE site_id=?", (body.status, site_id))
     if cur.rowcount == 0:
-        conn.close()
         raise HTTPException(status_code=404, detail="site not found")
-    conn.commit()
-    conn.close()
+    _invalidate_summary()
     return {"ok": True}
 
 @app.get("/api/export/sites.csv")
-def api_export_sites_csv(q: Optional[str] = None,
+async def api_export_sites_csv(q: Optional[str] = None,
                          status: Optional[str] = None,
                          site_type: Optional[str] = None,
                          category_id: Optional[int] = None,
@@ -320,36 +678,30 @@ def api_export_sites_csv(q: Optional[str] = None,
         "priority": (priority or "").strip(),
         "due_window": due_window,
     }
-    conn = db(); cur = conn.cursor()
+    today, today_30, today_90 = _today_bounds()
     params: list[Any] = []
-    where = build_where(filters, params)
+    where = build_where(filters, params, today, today_30, today_90)
 
     sql = f"""
-      SELECT s.site_id, s.name, s.uprn, s.site_code, s.status, s.site_type_code,
-             (SELECT MIN(p2.next_due_date) FROM view_active_ppm p2 WHERE p2.site_id=s.site_id) AS min_next_due,
-             (SELECT SUM(CASE WHEN p3.next_due_date IS NOT NULL AND p3.next_due_date < date('now') THEN 1 ELSE 0 END)
-              FROM view_active_ppm p3 WHERE p3.site_id=s.site_id) AS overdue_count,
-             (SELECT COUNT(*) FROM view_active_ppm p4 WHERE p4.site_id=s.site_id) AS active_ppm
-      FROM site s
+      {SITES_SELECT}
       {where}
       ORDER BY s.name
       LIMIT ?
     """
     params.append(limit)
-    rows = [dict(r) for r in cur.execute(sql, params).fetchall()]
-    conn.close()
 
-    # build CSV
-    import io, csv
-    buf = io.StringIO()
-    w = csv.DictWriter(buf, fieldnames=list(rows[0].keys()) if rows else
-                       ["site_id","name","uprn","site_code","status","site_type_code","min_next_due","overdue_count","active_ppm"])
-    w.writeheader()
-    for r in rows:
-        w.writerow(r)
-    csv_bytes = buf.getvalue().encode("utf-8")
+    # stream CSV straight off the cursor as raw tuples, one chunk of rows per body write;
+    # uses its own connection, held until the last chunk (a slow client can't starve read_conn())
+    async def gen():
+        async with export_conn() as conn, conn.execute(sql, params) as cur:
+            cur.row_factory = None
+            w = csv.writer(_Echo())
+            yield w.writerow([d[0] for d in cur.description])
+            while rows := await cur.fetchmany(CSV_CHUNK_ROWS):
+                yield "".join(map(w.writerow, rows))
+
     headers = {"Content-Disposition": "attachment; filename=sites_export.csv"}
-    return Response(content=csv_bytes, media_type="text/csv; charset=utf-8", headers=headers)
+    return StreamingResponse(gen(), media_type="text/csv; charset=utf-8", headers=headers)
 
 # --------------------- Minimal UI: Dashboard ---------------------
 INDEX_HTML = r"""
@@ -433,6 +785,7 @@ INDEX_HTML = r"""
           <option>Active</option><option>Closed</option><option>Suspended</option><option>Under-Construction</option><option>Unknown</option>
         </select>
         <button class="ghost" onclick="toggleInactive()" id="toggleInactive" style="display:none">Show inactive PPM</button>
+        <button onclick="saveAll()" id="saveAll" style="display:none">Save All</button>
       </div>
       <div id="ppmList"></div>
     </aside>
@@ -521,6 +874,7 @@ async function selectSite(site){
   const sel = document.getElementById('siteStatus');
   sel.value = site.status; sel.disabled = false;
   document.getElementById('toggleInactive').style.display = 'inline-block';
+  document.getElementById('saveAll').style.display = 'inline-block';
   await loadPPM();
 }
 
@@ -566,6 +920,15 @@ async function saveUpdate(id){
   await loadSummary();
 }
 
+async function saveAll(){
+  if(!pending.size){ alert('Nothing to save'); return; }
+  const r = await fetch('/api/ppm/bulk', {method:'PATCH', headers:{'Content-Type':'application/json'}, body: JSON.stringify([...pending])});
+  if(!r.ok){ alert('Save failed'); return; }
+  pending.clear();
+  await loadPPM();
+  await loadSummary();
+}
+
 async function loadPPM(){
   if(!currentSite) return;
   const params = new URLSearchParams({site_id: currentSite.site_id});
@@ -674,12 +1037,95 @@ async function updateSite(site_id, status){
 </html>
 """
 
-@app.get("/", response_class=HTMLResponse)
-def index_html():
+# --------------------- Static UI ---------------------
+# The pages never change at runtime: write them (plus gzip -9 copies) under STATIC_DIR once
+# and let StaticFiles serve them, with ETag/Last-Modified handling, without a Python route.
+STATIC_PAGES = {
     # Colors + layout per your UI reference sheet (blue header, green/amber/red, toolbar, board, sidebar).  # :contentReference[oaicite:1]{index=1}
-    return HTMLResponse(INDEX_HTML)
-
-@app.get("/app/admin.html", response_class=HTMLResponse)
-def admin_html():
+    "index.html": INDEX_HTML,
     # Admin page for editing site status & viewing basic site info.  # :contentReference[oaicite:2]{index=2}
-    return HTMLResponse(ADMIN_HTML)
+    "app/admin.html": ADMIN_HTML,
+}
+# request path -> precompressed file (relative to STATIC_DIR)
+_GZIP_PATHS = {"/": "/index.html.gz", **{f"/{name}": f"/{name}.gz" for name in STATIC_PAGES}}
+
+def _write_if_changed(path: str, data: bytes):
+    # leave unchanged files alone so their mtime-based ETags stay stable across restarts
+    try:
+        with open(path, "rb") as f:
+            if f.read() == data:
+                return
+    except FileNotFoundError:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+
+def write_static_pages():
+    for name, html in STATIC_PAGES.items():
+        body = html.encode()
+        path = os.path.join(STATIC_DIR, name)
+        _write_if_changed(path, body)
+        _write_if_changed(path + ".gz", gzip.compress(body, 9, mtime=0))
+
+def _accepts_gzip(accept_encoding: str) -> bool:
+    """
+    True if an Accept-Encoding value allows gzip. A gzip entry with q=0 is an
+    explicit refusal; "*" only counts when gzip isn't listed itself.
+    """
+    wildcard = False
+    for token in accept_encoding.split(","):
+        coding, *params = (p.strip() for p in token.split(";"))
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        coding = coding.lower()
+        if coding in ("gzip", "x-gzip"):
+            return q > 0
+        if coding == "*":
+            wildcard = q > 0
+    return wildcard
+
+class GzipStaticMiddleware:
+    """Serves the precompressed .gz page when the client accepts gzip."""
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        if scope["path"].endswith(".gz"):
+            # the precompressed copies are only reachable through their page's path
+            return await Response(status_code=404)(scope, receive, send)
+        if scope["method"] not in ("GET", "HEAD") or scope["path"] not in _GZIP_PATHS:
+            return await self.app(scope, receive, send)
+
+        gz = _accepts_gzip(",".join(v.decode("latin-1") for k, v in scope["headers"]
+                                    if k == b"accept-encoding"))
+        if gz:
+            # no range requests on the .gz body: a byte slice of it isn't valid gzip
+            path = _GZIP_PATHS[scope["path"]]
+            headers = [(k, v) for k, v in scope["headers"] if k not in (b"range", b"if-range")]
+            scope = {**scope, "path": path, "raw_path": path.encode(), "headers": headers}
+
+        async def send_page(message):
+            if message["type"] == "http.response.start" and message["status"] in (200, 206, 304):
+                headers = [(k, v) for k, v in message.get("headers", []) if k != b"content-type"]
+                headers += [(b"content-type", b"text/html; charset=utf-8"),
+                            (b"cache-control", b"public, max-age=300"),
+                            (b"vary", b"Accept-Encoding")]
+                if gz:
+                    headers.append((b"content-encoding", b"gzip"))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        await self.app(scope, receive, send_page)
+
+write_static_pages()
+app.add_middleware(GzipStaticMiddleware)
+# mounted last so the API routes above take precedence
+app.mount("/", StaticFiles(directory=STATIC_DIR, html=True), name="static")
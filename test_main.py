@@ -0,0 +1,344 @@
+import sqlite3
+
+import pytest
+
+
+# --------------------- Models ---------------------
+def test_ppm_update_blank_date_becomes_none(app_module):
+    body = app_module.PpmUpdate(next_due_date="", finished_date="2024-01-01")
+    assert body.next_due_date is None
+    assert body.finished_date == "2024-01-01"
+
+
+@pytest.mark.parametrize("value", [
+    "2024-1-01",
+    "01/01/2024",
+    "2024-01-01T00:00",
+    20240101,
+    "\uff12\uff10\uff12\uff14-01-01",       # full-width digits
+    "\u0662\u0660\u0662\u0664-01-01",       # Arabic-Indic digits
+])
+def test_ppm_update_rejects_non_iso_dates(client, db, value):
+    r = client.patch("/api/ppm/2", json={"next_due_date": value})
+    assert r.status_code == 422
+    assert db.execute("SELECT next_due_date FROM ppm_plan WHERE ppm_plan_id = 2").fetchone()[0] == "2999-01-01"
+
+
+# --------------------- /api/summary ---------------------
+def test_summary_is_cached_within_ttl(client, db, app_module):
+    app_module._invalidate_summary()
+    first = client.get("/api/summary").json()
+    # a write that bypasses the API doesn't invalidate the cache
+    db.execute("UPDATE site SET status = 'Closed' WHERE site_id = 'S2'")
+    db.commit()
+    try:
+        assert client.get("/api/summary").json() == first
+        app_module._invalidate_summary()
+        assert client.get("/api/summary").json()["active_sites"] == first["active_sites"] - 1
+    finally:
+        db.execute("UPDATE site SET status = 'Active' WHERE site_id = 'S2'")
+        db.commit()
+        app_module._invalidate_summary()
+
+
+@pytest.mark.parametrize("path, body, undo, field, delta", [
+    ("/api/ppm/1", {"next_due_date": "2999-06-01"}, {"next_due_date": "2000-01-01"}, "overdue", -1),
+    ("/api/ppm/bulk", [[1, {"next_due_date": "2999-06-01"}]], [[1, {"next_due_date": "2000-01-01"}]], "overdue", -1),
+    ("/api/site/S2", {"status": "Closed"}, {"status": "Active"}, "active_sites", -1),
+])
+def test_summary_reflects_writes(client, path, body, undo, field, delta):
+    before = client.get("/api/summary").json()[field]
+    assert client.patch(path, json=body).status_code == 200
+    try:
+        assert client.get("/api/summary").json()[field] == before + delta
+    finally:
+        assert client.patch(path, json=undo).status_code == 200
+    assert client.get("/api/summary").json()[field] == before
+
+
+def test_summary_not_cached_when_a_write_lands_mid_query(client, app_module, monkeypatch):
+    read_conn = app_module.read_conn
+
+    @app_module.asynccontextmanager
+    async def read_conn_racing_a_write():
+        async with read_conn() as conn:
+            app_module._invalidate_summary()
+            yield conn
+
+    app_module._invalidate_summary()
+    monkeypatch.setattr(app_module, "read_conn", read_conn_racing_a_write)
+    client.get("/api/summary")
+    assert app_module._summary_cache["expires"] == 0.0
+
+    monkeypatch.setattr(app_module, "read_conn", read_conn)
+    client.get("/api/summary")
+    assert app_module._summary_cache["expires"] > 0.0
+
+
+# --------------------- /api/sites ---------------------
+@pytest.mark.parametrize("due", [
+    [-1],        # overdue
+    [0],         # due today
+    [30],        # last day of the DUE_SOON window
+    [31],
+    [None],      # active PPM without a due date
+    [""],
+    [],          # no active PPM at all (the card SQL sees no ppm_site_agg row)
+], ids=["overdue", "today", "plus30", "plus31", "null", "empty", "no_ppm"])
+def test_card_ui_status_matches_classify_site_status(client, db, app_module, due):
+    from datetime import date, timedelta
+
+    today = date.today()
+    db.execute("INSERT INTO site VALUES ('R1', 'Rag Case', 'UPR1', 'RAG1', 'Active', 'PUB', NULL)")
+    db.executemany(
+        "INSERT INTO ppm_plan (site_id, category_id, instruction, priority, next_due_date) VALUES ('R1', 1, 'Check', 'High', ?)",
+        [(d if d is None or d == "" else (today + timedelta(days=d)).isoformat(),) for d in due],
+    )
+    db.commit()
+    try:
+        client.portal.call(app_module._refresh_agg)
+        agg = db.execute("SELECT min_next_due, overdue_count FROM ppm_site_agg WHERE site_id = 'R1'").fetchone()
+        expected = app_module.classify_site_status(agg and agg["min_next_due"], bool(agg and agg["overdue_count"]))
+
+        if due:
+            rows = client.get("/api/sites", params={"q": "RAG1"}).json()
+            assert [r["site_id"] for r in rows] == ["R1"]
+            ui_status = rows[0]["ui_status"]
+        else:
+            # /api/sites only lists sites with active PPM; check the card SQL directly
+            ui_status = db.execute(
+                app_module.SITES_CARD_SELECT + " WHERE s.site_id = 'R1'", app_module._today_bounds()[:2]
+            ).fetchone()["ui_status"]
+        assert ui_status == expected
+    finally:
+        db.execute("DELETE FROM ppm_plan WHERE site_id = 'R1'")
+        db.execute("DELETE FROM site WHERE site_id = 'R1'")
+        db.commit()
+        client.portal.call(app_module._refresh_agg)
+
+
+def test_site_search_follows_site_writes(client, db):
+    def search(q):
+        return [r["site_id"] for r in client.get("/api/sites", params={"q": q}).json()]
+
+    def fts_in_sync():
+        # external-content check: rank=1 compares the index against the site rows
+        db.execute("INSERT INTO site_fts(site_fts, rank) VALUES ('integrity-check', 1)")
+
+    db.execute("INSERT INTO site VALUES ('F1', 'Kings Head', 'UPF1', 'KH9', 'Active', 'PUB', NULL)")
+    db.execute("INSERT INTO ppm_plan (site_id, category_id, instruction, priority, next_due_date) "
+               "VALUES ('F1', 1, 'Check', 'High', '2999-01-01')")
+    db.commit()
+    try:
+        assert search("kings") == ["F1"]
+        fts_in_sync()
+
+        db.execute("UPDATE site SET name = 'Queens Arms', site_code = 'QA9' WHERE site_id = 'F1'")
+        db.commit()
+        assert search("kings") == [] and search("kh9") == []
+        assert search("queens arms") == ["F1"] and search("qa9") == ["F1"]
+        fts_in_sync()
+
+        # columns outside the index don't fire the update trigger
+        db.execute("UPDATE site SET status = 'Closed' WHERE site_id = 'F1'")
+        db.commit()
+        assert search("queens") == ["F1"]
+        fts_in_sync()
+    finally:
+        db.execute("DELETE FROM ppm_plan WHERE site_id = 'F1'")
+        db.execute("DELETE FROM site WHERE site_id = 'F1'")
+        db.commit()
+
+    assert db.execute("SELECT COUNT(*) FROM site_fts WHERE site_fts MATCH 'queens'").fetchone()[0] == 0
+    fts_in_sync()
+
+
+# --------------------- /api/filters ---------------------
+def test_filters_etag_revalidates(client, app_module):
+    r = client.get("/api/filters")
+    assert r.status_code == 200
+    body = r.json()
+    assert r.headers["etag"] == app_module.make_etag(app_module.orjson.dumps(body, option=app_module.orjson.OPT_SORT_KEYS))
+
+    again = client.get("/api/filters", headers={"If-None-Match": r.headers["etag"]})
+    assert again.status_code == 304
+    assert again.headers["etag"] == r.headers["etag"]
+
+
+# --------------------- /api/ppm/bulk ---------------------
+@pytest.fixture
+def writer_spy(app_module, monkeypatch):
+    """Record the statements the shared writer runs via execute() / executemany()."""
+    calls = []
+    conn = app_module._writer
+    execute, executemany = conn.execute, conn.executemany
+
+    def spy_execute(sql, *args):
+        calls.append(("execute", sql.strip()))
+        return execute(sql, *args)
+
+    def spy_executemany(sql, rows):
+        calls.append(("executemany", sql.strip(), len(rows)))
+        return executemany(sql, rows)
+
+    monkeypatch.setattr(conn, "execute", spy_execute)
+    monkeypatch.setattr(conn, "executemany", spy_executemany)
+    return calls
+
+
+def test_bulk_groups_by_field_set_in_one_transaction(client, db, writer_spy):
+    r = client.patch("/api/ppm/bulk", json=[
+        [3, {"next_due_date": "2031-01-01"}],
+        [4, {"next_due_date": "2031-02-01"}],
+        [5, {"retired_reason": "asset removed"}],
+    ])
+    assert r.status_code == 200
+    assert r.json() == {"ok": True, "updated": 3}
+
+    # BEGIN, one executemany per run of rows with the same field set, a single COMMIT
+    # (anything after that is the background ppm_site_agg refresh)
+    begin, first, second, commit = writer_spy[:4]
+    assert begin == ("execute", "BEGIN") and commit == ("execute", "COMMIT")
+    assert first[0] == second[0] == "executemany"
+    assert [first[2], second[2]] == [2, 1]
+
+    rows = dict(db.execute("SELECT ppm_plan_id, next_due_date FROM ppm_plan WHERE ppm_plan_id IN (3, 4)").fetchall())
+    assert rows == {3: "2031-01-01", 4: "2031-02-01"}
+
+
+def test_bulk_applies_edits_in_request_order(client, db, writer_spy):
+    r = client.patch("/api/ppm/bulk", json=[
+        [3, {"next_due_date": "2033-01-01"}],
+        [3, {"next_due_date": "2033-02-01", "finished_date": "2032-12-01"}],
+        [3, {"next_due_date": "2033-03-01"}],
+    ])
+    assert r.status_code == 200
+    assert r.json() == {"ok": True, "updated": 3}
+    assert [c[2] for c in writer_spy[1:4]] == [1, 1, 1]
+    row = db.execute("SELECT next_due_date, finished_date FROM ppm_plan WHERE ppm_plan_id = 3").fetchone()
+    assert tuple(row) == ("2033-03-01", "2032-12-01")
+
+
+def test_bulk_counts_only_existing_rows(client):
+    r = client.patch("/api/ppm/bulk", json=[[3, {"finished_date": "2025-01-01"}], [999, {"finished_date": "2025-01-01"}]])
+    assert r.status_code == 200
+    assert r.json()["updated"] == 1
+
+
+def test_bulk_rejects_empty_item(client):
+    r = client.patch("/api/ppm/bulk", json=[[3, {}]])
+    assert r.status_code == 400
+
+
+def test_bulk_rolls_back_when_a_row_fails(client, db, app_module):
+    db.execute("""
+        CREATE TRIGGER fail_ppm BEFORE UPDATE ON ppm_plan WHEN NEW.retired_reason = 'boom'
+        BEGIN SELECT RAISE(ABORT, 'boom'); END
+    """)
+    db.commit()
+    try:
+        with pytest.raises(sqlite3.DatabaseError):
+            client.patch("/api/ppm/bulk", json=[
+                [3, {"next_due_date": "2040-01-01"}],
+                [4, {"retired_reason": "boom"}],
+            ])
+    finally:
+        db.execute("DROP TRIGGER fail_ppm")
+        db.commit()
+
+    assert db.execute("SELECT next_due_date FROM ppm_plan WHERE ppm_plan_id = 3").fetchone()[0] != "2040-01-01"
+    assert not app_module._writer.in_transaction
+    # writer is usable again afterwards
+    assert client.patch("/api/ppm/bulk", json=[[3, {"next_due_date": "2032-01-01"}]]).json()["updated"] == 1
+
+
+# --------------------- DB helpers ---------------------
+def test_readonly_conn_handles_uri_special_characters(app_module, monkeypatch, tmp_path):
+    import asyncio
+    import os
+    import shutil
+
+    odd = tmp_path / "ppm #1 ?50%" / "ppm.db"
+    odd.parent.mkdir()
+    shutil.copy(os.environ["DB_PATH"], odd)
+    monkeypatch.setattr(app_module, "DB_PATH", str(odd))
+
+    async def count_sites():
+        conn = await app_module._make_conn(readonly=True)
+        try:
+            async with conn.execute("SELECT COUNT(*) FROM site") as cur:
+                return (await cur.fetchone())[0]
+        finally:
+            await conn.close()
+
+    assert asyncio.run(count_sites()) == 3
+
+
+# --------------------- /api/export/sites.csv ---------------------
+def test_export_does_not_hold_a_shared_reader(client, app_module):
+    async def start_export():
+        resp = await app_module.api_export_sites_csv()
+        body = resp.body_iterator
+        header = await body.__anext__()
+        free = app_module._readers.qsize()
+        await body.aclose()
+        return header, free
+
+    header, free = client.portal.call(start_export)
+    assert header.startswith("site_id,")
+    assert free == app_module.READ_POOL_SIZE
+
+
+def test_exports_wait_for_a_free_slot(client, app_module):
+    import asyncio
+
+    async def open_exports():
+        bodies = [(await app_module.api_export_sites_csv()).body_iterator
+                  for _ in range(app_module.EXPORT_CONCURRENCY + 1)]
+        *running, extra = bodies
+        for body in running:
+            await body.__anext__()
+        waiting = asyncio.ensure_future(extra.__anext__())
+        await asyncio.sleep(0.2)
+        blocked = not waiting.done()
+        await running[0].aclose()
+        header = await asyncio.wait_for(waiting, 5)
+        for body in (*running[1:], extra):
+            await body.aclose()
+        return blocked, header
+
+    blocked, header = client.portal.call(open_exports)
+    assert blocked
+    assert header.startswith("site_id,")
+
+
+def test_export_streams_filtered_rows(client):
+    r = client.get("/api/export/sites.csv", params={"status": "Active"})
+    assert r.status_code == 200
+    lines = r.text.splitlines()
+    assert lines[0].startswith("site_id,name,")
+    assert sorted(line.split(",")[0] for line in lines[1:]) == ["S1", "S2"]
+
+
+# --------------------- static pages ---------------------
+@pytest.mark.parametrize("path, headers, status, gzipped", [
+    ("/", {"Accept-Encoding": "gzip"}, 200, True),
+    ("/", {"Accept-Encoding": "deflate, gzip;q=0.5"}, 200, True),
+    ("/", {"Accept-Encoding": "*"}, 200, True),
+    ("/", {"Accept-Encoding": "gzip;q=0"}, 200, False),
+    ("/", {"Accept-Encoding": "GZIP; q=0.0, deflate"}, 200, False),
+    ("/", {"Accept-Encoding": "*;q=1, gzip;q=0"}, 200, False),
+    ("/", {"Accept-Encoding": "identity"}, 200, False),
+    ("/", {"Accept-Encoding": ""}, 200, False),
+    # a byte range of the .gz body isn't valid gzip: send the whole compressed page
+    ("/", {"Accept-Encoding": "gzip", "Range": "bytes=0-10"}, 200, True),
+    ("/index.html.gz", {"Accept-Encoding": "gzip"}, 404, False),
+    ("/app/admin.html.gz", {"Accept-Encoding": "identity"}, 404, False),
+])
+def test_index_honours_accept_encoding(client, path, headers, status, gzipped):
+    r = client.get(path, headers=headers)
+    assert r.status_code == status
+    assert (r.headers.get("content-encoding") == "gzip") is gzipped
+    if status == 200:
+        assert r.headers["content-type"] == "text/html; charset=utf-8"
+        assert "<html" in r.text.lower()